@@ -1,58 +1,202 @@
 import os
+import json
 import time
-import requests
-import subprocess
-import socket
 import logging
-from datetime import datetime
-from security import CommandSecurity
 
-# URL do seu FastAPI
-SERVER_URL = "https://sistema-de-gerenciamento-remot-b77adc170aa9.herokuapp.com"
-MACHINE_FILE = "/etc/agent_id"  # onde salvar o ID único da máquina
+# Imports pesados (http.client, subprocess, threading, security) são feitos
+# só quando usados, para reduzir o tempo de partida e a memória do agente.
 
+CONFIG_FILE = os.getenv("AGENT_CONFIG", "/etc/agent.conf")
 
-#LOGGING CONFIG
-LOG_FILE = "/var/log/linux_agent.log"  # log persistente
-os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+DEFAULT_CONFIG = {
+    "SERVER_URL": "https://sistema-de-gerenciamento-remot-b77adc170aa9.herokuapp.com",  # URL do seu FastAPI
+    "MACHINE_FILE": "/etc/agent_id",  # onde salvar o ID único da máquina
+    "MACHINE_NAME": "",  # vazio usa o hostname
+    "LOG_FILE": "/var/log/linux_agent.log",  # log persistente; vazio desativa
+    "POLL_INTERVAL": "300",  # segundos entre ciclos
+    "POLL_WAIT": "0",  # segundos de long-poll por busca de comandos (0 desliga)
+    "COMMAND_TIMEOUT": "120",
+    "HTTP_TIMEOUT": "30",
+    "COMPRESSION": "gzip",  # gzip, zstd (requer zstandard) ou none; só após o servidor anunciar
+    "COMPRESS_MIN_SIZE": "1024",  # corpos menores vão sem compressão
+    "ENCODING": "json",  # json ou msgpack (requer msgpack)
+}
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()  # também mostra no console
-    ]
-)
+
+# Configuração: valores padrão < arquivo (CHAVE=valor) < variáveis AGENT_<CHAVE>
+def load_config():
+    config = dict(DEFAULT_CONFIG)
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                config[key.strip().upper()] = value.strip().strip("\"'")
+    for key in config:
+        value = os.getenv(f"AGENT_{key}")
+        if value is not None:
+            config[key] = value
+    return config
+
+
+CONFIG = load_config()
+SERVER_URL = CONFIG["SERVER_URL"].rstrip("/")
+MACHINE_FILE = CONFIG["MACHINE_FILE"]
+LOG_FILE = CONFIG["LOG_FILE"]
+POLL_INTERVAL = int(CONFIG["POLL_INTERVAL"])
+POLL_WAIT = int(CONFIG["POLL_WAIT"])
+COMMAND_TIMEOUT = int(CONFIG["COMMAND_TIMEOUT"])
+HTTP_TIMEOUT = int(CONFIG["HTTP_TIMEOUT"])
+COMPRESSION = CONFIG["COMPRESSION"].lower()
+COMPRESS_MIN_SIZE = int(CONFIG["COMPRESS_MIN_SIZE"])
+ENCODING = CONFIG["ENCODING"].lower()
 
 logger = logging.getLogger("LinuxAgent")
 
+
+#LOGGING CONFIG (feita ao iniciar, não no import)
+def configure_logging():
+    handlers = [logging.StreamHandler()]  # também mostra no console
+    if LOG_FILE:
+        log_dir = os.path.dirname(LOG_FILE)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        handlers.append(logging.FileHandler(LOG_FILE))
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=handlers
+    )
+
+
 # Identificação da máquina
 def get_machine_id():
     if os.path.exists(MACHINE_FILE):
         with open(MACHINE_FILE, "r") as f:
-            return f.read().strip()
+            return f.read().strip() or None
     else:
         return None
 
-MACHINE_NAME = socket.gethostname()
+MACHINE_NAME = CONFIG["MACHINE_NAME"] or os.uname().nodename
 MACHINE_ID = get_machine_id()
 
+
+# Codificação dos corpos: JSON (padrão) ou msgpack, se configurado e instalado.
+# O servidor só aceita msgpack nos endpoints de comandos.
+def use_msgpack(path):
+    return ENCODING == "msgpack" and path.startswith("/commands/")
+
+
+def encode_body(payload, path):
+    if use_msgpack(path):
+        import msgpack
+        return msgpack.packb(payload, use_bin_type=True), "application/msgpack"
+    return json.dumps(payload).encode("utf-8"), "application/json"
+
+
+def decode_body(data, content_type):
+    if content_type.startswith("application/msgpack"):
+        import msgpack
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+# Compressão: os resultados (saídas de comandos) dominam o tráfego.
+# Compressões de requisição anunciadas pelo servidor no Accept-Encoding das
+# respostas (RFC 7694); vazio até a primeira resposta. Sem anúncio os corpos
+# vão sem compressão, então o agente funciona com servidores antigos.
+SERVER_ENCODINGS = set()
+
+
+def request_compression():
+    if COMPRESSION == "none":
+        return None
+    if COMPRESSION in SERVER_ENCODINGS:
+        return COMPRESSION
+    if "gzip" in SERVER_ENCODINGS:
+        return "gzip"
+    return None
+
+
+def compress_body(body, encoding):
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    import gzip
+    return gzip.compress(body, compresslevel=6)
+
+
+def decompress_body(data, content_encoding):
+    if content_encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if content_encoding == "gzip":
+        import gzip
+        return gzip.decompress(data)
+    return data
+
+
+# Cliente HTTP mínimo, só com a biblioteca padrão
+def send_request(method, path, body, content_type, encoding):
+    global SERVER_ENCODINGS
+    import http.client
+    from urllib.parse import urlsplit
+
+    url = urlsplit(SERVER_URL)
+    if url.scheme == "https":
+        conn = http.client.HTTPSConnection(url.netloc, timeout=HTTP_TIMEOUT + POLL_WAIT)
+    else:
+        conn = http.client.HTTPConnection(url.netloc, timeout=HTTP_TIMEOUT + POLL_WAIT)
+
+    try:
+        headers = {
+            "Accept": "application/msgpack" if use_msgpack(path) else "application/json"
+        }
+        if COMPRESSION != "none":
+            headers["Accept-Encoding"] = "zstd, gzip" if COMPRESSION == "zstd" else "gzip"
+        if content_type:
+            headers["Content-Type"] = content_type
+        if encoding:
+            body = compress_body(body, encoding)
+            headers["Content-Encoding"] = encoding
+        conn.request(method, url.path + path, body=body, headers=headers)
+        resp = conn.getresponse()
+        advertised = resp.getheader("Accept-Encoding") or ""
+        SERVER_ENCODINGS = {e.strip().lower() for e in advertised.split(",") if e.strip()}
+        data = decompress_body(resp.read(), (resp.getheader("Content-Encoding") or "").lower())
+        return resp.status, data, resp.getheader("Content-Type") or ""
+    finally:
+        conn.close()
+
+
+def http_request(method, path, payload=None):
+    body, content_type = encode_body(payload, path) if payload is not None else (None, None)
+    encoding = request_compression() if body is not None and len(body) >= COMPRESS_MIN_SIZE else None
+    status, data, response_type = send_request(method, path, body, content_type, encoding)
+    if encoding and status in (400, 415, 422):
+        # Réplica que não entende a compressão (ex.: deploy em andamento): repete sem comprimir
+        logger.warning(f"Servidor recusou corpo {encoding} em {method} {path} (HTTP {status}), reenviando sem compressão")
+        status, data, response_type = send_request(method, path, body, content_type, None)
+    if status >= 400:
+        raise RuntimeError(f"HTTP {status} em {method} {path}: {data[:200]!r}")
+    return decode_body(data, response_type) if data else {}
+
+
 # Registrar ou atualizar a máquina no servidor
 def register_machine():
     global MACHINE_ID
     try:
         logger.info(f"Tentando registrar/atualizar máquina: {MACHINE_NAME}")
-        resp = requests.post(f"{SERVER_URL}/register_machine", json={
-            "name": MACHINE_NAME
-        })
-        resp.raise_for_status()
-        data = resp.json()
+        data = http_request("POST", "/register_machine", {"name": MACHINE_NAME})
         machine_id_from_server = data.get("machine_id")
         if machine_id_from_server:
+            if machine_id_from_server != MACHINE_ID:
+                with open(MACHINE_FILE, "w") as f:
+                    f.write(machine_id_from_server)
             MACHINE_ID = machine_id_from_server
-            with open(MACHINE_FILE, "w") as f:
-                f.write(MACHINE_ID)
             logger.info(f"Máquina registrada/atualizada com sucesso (ID: {MACHINE_ID})")
         else:
             logger.error("Servidor não retornou machine_id")
@@ -68,9 +212,10 @@ def check_commands():
 
     try:
         logger.info("Verificando comandos pendentes...")
-        resp = requests.get(f"{SERVER_URL}/commands/{MACHINE_ID}")
-        resp.raise_for_status()
-        data = resp.json()
+        path = f"/commands/{MACHINE_ID}"
+        if POLL_WAIT > 0:
+            path += f"?wait={POLL_WAIT}"
+        data = http_request("GET", path)
         command_count = len(data.get("commands", []))
         logger.info(f"{command_count} comando(s) pendente(s) recebido(s) do servidor")
 
@@ -80,45 +225,67 @@ def check_commands():
         logger.error(f"Erro ao buscar comandos: {e}")
 
 
+# Verificar o veredito de segurança enviado pelo servidor
+def is_blocked(cmd):
+    from security import CommandSecurity
+
+    script_content = cmd["script_content"]
+    verdict = cmd.get("verdict") or {}
+
+    # Só revalida localmente se o conteúdo não bate com o hash validado
+    # ou se as regras locais diferem das usadas pelo servidor
+    if (verdict.get("content_hash") != CommandSecurity.content_hash(script_content)
+            or verdict.get("ruleset_version") != CommandSecurity.RULESET_VERSION):
+        logger.info(f"Revalidando localmente o comando {cmd['id']}")
+        return CommandSecurity.is_dangerous(script_content)
+
+    if verdict.get("is_dangerous"):
+        logger.warning(f"Servidor marcou o comando {cmd['id']} como perigoso (regra: {verdict.get('matched_rule')})")
+    return bool(verdict.get("is_dangerous"))
+
+
 # Executar comando
 def execute_command(cmd):
     cmd_id = cmd["id"]
     script_name = cmd["script_name"]
     script_content = cmd["script_content"]
 
-    if CommandSecurity.is_dangerous(script_content):
+    if is_blocked(cmd):
         output = "ERRO: Comando bloqueado por segurança."
         logger.warning(f"Comando {cmd_id} bloqueado: {script_content}")
-        send_result(cmd_id, output)
+        send_result(cmd_id, output, -1)
         return
 
     logger.info(f"Executando comando {cmd_id}: {script_name}")
 
+    import subprocess
     try:
         result = subprocess.run(
             script_content,
             shell=True,
             capture_output=True,
             text=True,
-            timeout=120
+            timeout=COMMAND_TIMEOUT
         )
         output = result.stdout + result.stderr
+        return_code = result.returncode
         logger.info(f"Comando {cmd_id} executado - Status {result.returncode}")
     except Exception as e:
         output = f"Erro ao executar comando: {e}"
+        return_code = -1
         logger.error(f"Falha ao executar comando {cmd_id}: {e}")
 
-    send_result(cmd_id, output)
+    send_result(cmd_id, output, return_code)
 
 
 # Enviar resultado de volta
-def send_result(cmd_id, output):
+def send_result(cmd_id, output, return_code=None):
     try:
         logger.info(f"Enviando resultado do comando {cmd_id}")
-        resp = requests.post(f"{SERVER_URL}/commands/{cmd_id}/result", json={
-            "output": output
+        http_request("POST", f"/commands/{cmd_id}/result", {
+            "output": output,
+            "return_code": return_code
         })
-        resp.raise_for_status()
         logger.info(f"Resultado do comando {cmd_id} enviado com sucesso")
     except Exception as e:
         logger.error(f"Falha ao enviar resultado do comando {cmd_id}: {e}")
@@ -126,17 +293,24 @@ def send_result(cmd_id, output):
 
 # Loop principal
 def main():
+    configure_logging()
     logger.info("🚀 Iniciando agente...")
 
     if MACHINE_ID is None:
         register_machine()
+    else:
+        # Com o ID em cache, o heartbeat inicial vai em segundo plano e a
+        # primeira busca de comandos não espera o registro
+        import threading
+        logger.info(f"Retomando com ID em cache: {MACHINE_ID}")
+        threading.Thread(target=register_machine, name="register", daemon=True).start()
 
     while True:
         logger.info("Iniciando ciclo de verificação")
-        register_machine()
         check_commands()
-        logger.info("Ciclo concluído - aguardando 5 minutos")
-        time.sleep(300)
+        logger.info(f"Ciclo concluído - aguardando {POLL_INTERVAL} segundos")
+        time.sleep(POLL_INTERVAL)
+        register_machine()
 
 
 if __name__ == "__main__":
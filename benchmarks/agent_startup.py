@@ -0,0 +1,147 @@
+"""Mede a partida do agente: tempo até a primeira busca de comandos e memória.
+
+Sobe um servidor HTTP falso local, inicia o agente como processo separado
+(com ID em cache) e registra, no momento em que chega o primeiro
+GET /commands, o tempo desde o início do processo e a memória residente
+do agente (VmRSS e pico VmHWM, lidos de /proc).
+
+Uso:
+    python benchmarks/agent_startup.py --runs 20
+    python benchmarks/agent_startup.py --agent /tmp/agent_antigo.py --patch-constants
+"""
+import argparse
+import json
+import os
+import queue
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MACHINE_ID = "00000000-0000-0000-0000-000000000000"
+
+
+def read_memory_kb(pid):
+    memory = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":", 1)
+                memory[key] = int(value.split()[0])
+    return memory
+
+
+def make_handler(agent_pid, polls):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._reply({"message": "Máquina atualizada", "machine_id": MACHINE_ID})
+
+        def do_GET(self):
+            if self.path.startswith("/commands/") and agent_pid[0]:
+                # Medido antes de responder: o agente está parado esperando a resposta
+                polls.put((time.perf_counter(), read_memory_kb(agent_pid[0])))
+            self._reply({"commands": []})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class QuietServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # O agente é encerrado logo após a medição; conexões cortadas são esperadas
+        pass
+
+
+def prepare_agent(workdir, agent_path, patch_constants, server_url, machine_file):
+    """Copia o agente (e security.py) para um diretório temporário"""
+    target = os.path.join(workdir, "agent.py")
+    shutil.copy(os.path.join(REPO_DIR, "security.py"), workdir)
+    with open(agent_path) as f:
+        source = f.read()
+    if patch_constants:
+        # Versões antigas do agente tinham URL e arquivo de ID fixos no código
+        lines = []
+        for line in source.splitlines():
+            if line.startswith("SERVER_URL = "):
+                line = f'SERVER_URL = "{server_url}"'
+            elif line.startswith("MACHINE_FILE = "):
+                line = f'MACHINE_FILE = "{machine_file}"'
+            elif line.startswith("LOG_FILE = "):
+                line = f'LOG_FILE = "{os.path.join(workdir, "agent.log")}"'
+            lines.append(line)
+        source = "\n".join(lines) + "\n"
+    with open(target, "w") as f:
+        f.write(source)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agent", default=os.path.join(REPO_DIR, "agent.py"))
+    parser.add_argument("--patch-constants", action="store_true",
+                        help="reescreve SERVER_URL/MACHINE_FILE/LOG_FILE fixos no código do agente")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    agent_pid = [None]
+    polls = queue.Queue()
+    server = QuietServer(("127.0.0.1", 0), make_handler(agent_pid, polls))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    workdir = tempfile.mkdtemp(prefix="agent_bench_")
+    machine_file = os.path.join(workdir, "agent_id")
+    with open(machine_file, "w") as f:
+        f.write(MACHINE_ID)
+    agent_path = prepare_agent(workdir, args.agent, args.patch_constants, server_url, machine_file)
+
+    env = dict(os.environ,
+               AGENT_CONFIG=os.path.join(workdir, "inexistente.conf"),
+               AGENT_SERVER_URL=server_url,
+               AGENT_MACHINE_FILE=machine_file,
+               AGENT_LOG_FILE="",
+               AGENT_POLL_INTERVAL="3600")
+
+    startup, rss, hwm = [], [], []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, agent_path], cwd=workdir, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        agent_pid[0] = proc.pid
+        try:
+            polled_at, memory = polls.get(timeout=30)
+        finally:
+            proc.kill()
+            proc.wait()
+            agent_pid[0] = None
+        startup.append((polled_at - start) * 1000)
+        rss.append(memory["VmRSS"] / 1024)
+        hwm.append(memory["VmHWM"] / 1024)
+
+    server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"agente: {args.agent} ({args.runs} execuções, Python {sys.version.split()[0]})")
+    print(f"até o 1º GET /commands: mediana {statistics.median(startup):.1f} ms, mín {min(startup):.1f} ms")
+    print(f"VmRSS: mediana {statistics.median(rss):.1f} MB | VmHWM: mediana {statistics.median(hwm):.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
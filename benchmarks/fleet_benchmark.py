@@ -0,0 +1,145 @@
+"""Simula uma frota de agentes contra a API e mede a vazão.
+
+Cada thread cuida de um grupo de máquinas simuladas e, para cada uma,
+repete o ciclo do agente: heartbeat (/register_machine), busca de
+comandos pendentes e envio dos resultados. Em paralelo, um agendador
+dispara /execute para máquinas aleatórias.
+
+Uso:
+    python benchmarks/fleet_benchmark.py --server http://127.0.0.1:8000 \\
+        --machines 1000 --concurrency 64 --duration 60
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+
+
+BENCH_SCRIPT = "bench_echo"
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        # Latência de despacho: do início do /execute até o agente receber o comando
+        self.scheduled = {}
+        self.received = {}
+
+    def record(self, endpoint, elapsed, ok):
+        with self._lock:
+            if ok:
+                self.latencies[endpoint].append(elapsed)
+            else:
+                self.errors[endpoint] += 1
+
+    def dispatch_latencies(self):
+        with self._lock:
+            return sorted(self.received[cid] - start for cid, start in self.scheduled.items() if cid in self.received)
+
+
+def call(server, method, path, payload=None, stats=None, endpoint=None):
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(f"{server}{path}", data=data, method=method,
+                                 headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            body = json.loads(resp.read())
+        ok = True
+    except Exception:
+        body, ok = None, False
+    if stats is not None:
+        stats.record(endpoint or path, time.perf_counter() - start, ok)
+    return body
+
+
+def agent_worker(server, names, poll_wait, ready, stop, stats):
+    machine_ids = {}
+    for name in names:
+        data = call(server, "POST", "/register_machine", {"name": name})
+        if data:
+            machine_ids[name] = data["machine_id"]
+    # A medição só começa quando toda a frota estiver registrada
+    ready.wait()
+
+    while not stop.is_set():
+        for name, machine_id in machine_ids.items():
+            if stop.is_set():
+                break
+            call(server, "POST", "/register_machine", {"name": name}, stats, "POST /register_machine")
+            data = call(server, "GET", f"/commands/{machine_id}?wait={poll_wait}", stats=stats, endpoint="GET /commands/{id}")
+            for cmd in (data or {}).get("commands", []):
+                stats.received.setdefault(cmd["id"], time.perf_counter())
+                call(server, "POST", f"/commands/{cmd['id']}/result",
+                     {"output": "bench\n", "return_code": 0}, stats, "POST /commands/{id}/result")
+
+
+def scheduler(server, names, rate, stop, stats):
+    interval = 1.0 / rate if rate > 0 else None
+    while interval and not stop.is_set():
+        start = time.perf_counter()
+        data = call(server, "POST", "/execute",
+                    {"machine_name": random.choice(names), "script_name": BENCH_SCRIPT}, stats, "POST /execute")
+        if data and "command_id" in data:
+            stats.scheduled[data["command_id"]] = start
+        time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", default="http://127.0.0.1:8000")
+    parser.add_argument("--machines", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64, help="threads de agentes simulados")
+    parser.add_argument("--duration", type=int, default=60, help="segundos de medição")
+    parser.add_argument("--execute-rate", type=float, default=20.0, help="comandos /execute por segundo")
+    parser.add_argument("--poll-wait", type=int, default=0, help="segundos de long-poll em /commands (0 desliga)")
+    parser.add_argument("--prefix", default="bench-")
+    args = parser.parse_args()
+
+    call(args.server, "POST", "/scripts", {"name": BENCH_SCRIPT, "content": "echo bench"})
+    names = [f"{args.prefix}{i:05d}" for i in range(args.machines)]
+
+    ready = threading.Barrier(args.concurrency + 1)
+    stop = threading.Event()
+    stats = Stats()
+    threads = [
+        threading.Thread(target=agent_worker, args=(args.server, names[i::args.concurrency], args.poll_wait, ready, stop, stats), daemon=True)
+        for i in range(args.concurrency)
+    ]
+    for t in threads:
+        t.start()
+    ready.wait()
+
+    sched = threading.Thread(target=scheduler, args=(args.server, names, args.execute_rate, stop, stats), daemon=True)
+    sched.start()
+    threads.append(sched)
+
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join(timeout=35)
+
+    total = 0
+    print(f"{'endpoint':32} {'reqs':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'erros':>6}")
+    for endpoint in sorted(set(stats.latencies) | set(stats.errors)):
+        lat = sorted(stats.latencies[endpoint])
+        total += len(lat)
+        p50 = statistics.median(lat) * 1000 if lat else 0
+        p95 = lat[int(len(lat) * 0.95) - 1] * 1000 if lat else 0
+        print(f"{endpoint:32} {len(lat):8d} {len(lat) / args.duration:9.1f} {p50:8.1f} {p95:8.1f} {stats.errors[endpoint]:6d}")
+    print(f"{'total':32} {total:8d} {total / args.duration:9.1f}")
+
+    dispatch = stats.dispatch_latencies()
+    if dispatch:
+        print(f"despacho /execute -> agente: {len(dispatch)}/{len(stats.scheduled)} recebidos, "
+              f"p50 {statistics.median(dispatch) * 1000:.0f} ms, p95 {dispatch[int(len(dispatch) * 0.95) - 1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Compara tamanho e latência dos formatos de payload entre agente e servidor.
+
+Gera saídas no estilo ``journalctl`` (ou usa um arquivo real com --input),
+monta os corpos de POST /commands/{id}/result e de uma resposta de
+GET /commands/{machine_id}, e mede para cada combinação de codificação
+(JSON, msgpack) e compressão (nenhuma, gzip, zstd):
+
+*   bytes no fio e razão em relação ao JSON puro;
+*   tempo de codificação + compressão e de descompressão + decodificação;
+*   latência estimada num link de --link-mbps (CPU dos dois lados + transmissão).
+
+Uso:
+    python benchmarks/wire_benchmark.py --sizes 262144 1048576 4194304 --link-mbps 2
+    journalctl -n 50000 --no-pager > /tmp/journal.txt
+    python benchmarks/wire_benchmark.py --input /tmp/journal.txt
+"""
+import argparse
+import gzip
+import json
+import random
+import statistics
+import time
+import uuid
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+HOSTS = ["web-01", "web-02", "db-01", "cache-03"]
+MONTHS = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+
+
+def journal_line(rng, ts):
+    host = rng.choice(HOSTS)
+    stamp = time.strftime(f"{MONTHS[ts.tm_mon - 1]} %d %H:%M:%S", ts)
+    kind = rng.random()
+    if kind < 0.30:
+        ip = f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        path = rng.choice(["/api/v1/items", "/api/v1/orders", "/health", "/static/app.js"])
+        return (f"{stamp} {host} nginx[{rng.randint(900, 1200)}]: {ip} - - "
+                f"\"GET {path}/{rng.randint(1, 99999)} HTTP/1.1\" {rng.choice([200, 200, 200, 304, 404, 500])} "
+                f"{rng.randint(120, 90000)} \"-\" \"Mozilla/5.0 (X11; Linux x86_64)\"")
+    if kind < 0.55:
+        return (f"{stamp} {host} app[{rng.randint(2000, 4000)}]: level={rng.choice(['info', 'info', 'warn', 'error'])} "
+                f"request_id={uuid.UUID(int=rng.getrandbits(128))} duration_ms={rng.randint(1, 2500)} "
+                f"user_id={rng.randint(1, 50000)} msg=\"{rng.choice(['request completed', 'cache miss', 'retrying upstream', 'slow query'])}\"")
+    if kind < 0.70:
+        return (f"{stamp} {host} sshd[{rng.randint(10000, 60000)}]: Accepted publickey for deploy from "
+                f"192.168.{rng.randint(0, 255)}.{rng.randint(1, 254)} port {rng.randint(30000, 65000)} ssh2: "
+                f"ED25519 SHA256:{rng.getrandbits(256):064x}")
+    if kind < 0.85:
+        return (f"{stamp} {host} systemd[1]: {rng.choice(['Started', 'Stopped', 'Reloaded'])} "
+                f"{rng.choice(['session', 'logrotate', 'apt-daily', 'certbot'])}-{rng.randint(1, 9999)}.service.")
+    return (f"{stamp} {host} kernel: [{rng.uniform(0, 900000):.6f}] audit: type=1400 "
+            f"audit({time.mktime(ts):.3f}:{rng.randint(100, 99999)}): apparmor=\"DENIED\" operation=\"open\" "
+            f"profile=\"/usr/sbin/{rng.choice(['named', 'cupsd', 'mysqld'])}\" pid={rng.randint(100, 40000)}")
+
+
+def synthetic_journal(size, seed=42):
+    rng = random.Random(seed)
+    t = time.mktime((2025, 9, 15, 0, 0, 0, 0, 0, -1))
+    lines, total = [], 0
+    while total < size:
+        t += rng.expovariate(20)
+        line = journal_line(rng, time.localtime(t))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def variants():
+    encodings = [("json", lambda p: json.dumps(p).encode("utf-8"), json.loads)]
+    if msgpack is not None:
+        encodings.append(("msgpack", lambda p: msgpack.packb(p, use_bin_type=True),
+                          lambda b: msgpack.unpackb(b, raw=False)))
+    compressions = [("none", lambda b: b, lambda b: b),
+                    ("gzip", lambda b: gzip.compress(b, compresslevel=6), gzip.decompress)]
+    if zstandard is not None:
+        compressions.append(("zstd", zstandard.ZstdCompressor(level=3).compress,
+                             lambda b: zstandard.ZstdDecompressor().decompressobj().decompress(b)))
+    for enc_name, encode, decode in encodings:
+        for comp_name, compress, decompress in compressions:
+            yield f"{enc_name}+{comp_name}", encode, decode, compress, decompress
+
+
+def measure(payload, repeat):
+    results = []
+    for name, encode, decode, compress, decompress in variants():
+        encode_times, decode_times = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            wire = compress(encode(payload))
+            encode_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            decoded = decode(decompress(wire))
+            decode_times.append(time.perf_counter() - start)
+        assert decoded == payload
+        results.append((name, len(wire), statistics.median(encode_times), statistics.median(decode_times)))
+    return results
+
+
+def report(title, payload, repeat, link_mbps):
+    results = measure(payload, repeat)
+    baseline = results[0][1]
+    print(f"\n{title}")
+    print(f"{'formato':16} {'bytes':>10} {'razão':>7} {'cod. ms':>8} {'decod. ms':>9} {'link ms':>9} {'total ms':>9}")
+    for name, size, enc, dec in results:
+        transfer = size * 8 / (link_mbps * 1_000_000)
+        print(f"{name:16} {size:10d} {size / baseline:7.3f} {enc * 1000:8.1f} {dec * 1000:9.1f} "
+              f"{transfer * 1000:9.1f} {(enc + transfer + dec) * 1000:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256 * 1024, 1024 * 1024, 4 * 1024 * 1024])
+    parser.add_argument("--input", help="arquivo de log real no lugar do gerado")
+    parser.add_argument("--link-mbps", type=float, default=2.0, help="banda do link até o site remoto")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, errors="replace") as f:
+            outputs = [(args.input, f.read())]
+    else:
+        outputs = [(f"journal sintético {size // 1024} KiB", synthetic_journal(size)) for size in args.sizes]
+
+    print(f"zstandard: {'sim' if zstandard else 'não'} | msgpack: {'sim' if msgpack else 'não'} | link: {args.link_mbps} Mbit/s")
+    for title, output in outputs:
+        report(f"POST /commands/{{id}}/result — {title}", {"output": output, "return_code": 0},
+               args.repeat, args.link_mbps)
+
+    script = "\n".join(f"systemctl restart app@{i}.service && sleep 1" for i in range(200))
+    poll = {"commands": [{
+        "id": 1234,
+        "script_name": "restart_all",
+        "script_content": script,
+        "script_version": 3,
+        "verdict": {"content_hash": "a" * 64, "is_dangerous": False,
+                    "matched_rule": None, "ruleset_version": "5907ebdc12481c8e"},
+    }]}
+    report("GET /commands/{machine_id} — 1 comando, script de 200 linhas", poll, args.repeat, args.link_mbps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Compressão e codificação compacta do tráfego entre agentes e servidor.
+
+Middleware ASGI que:
+
+*   descomprime corpos de requisição com ``Content-Encoding: gzip`` ou ``zstd``;
+*   comprime respostas com zstd ou gzip, conforme o ``Accept-Encoding`` do cliente;
+*   anuncia, no ``Accept-Encoding`` de toda resposta (RFC 7694), as compressões
+    aceitas nos corpos de requisição, para que o agente só comprima depois de
+    saber que o servidor entende;
+*   nos endpoints de comandos, aceita corpos ``application/msgpack`` e responde
+    em msgpack quando o cliente pede ``Accept: application/msgpack``.
+
+zstd e msgpack são opcionais: sem os pacotes ``zstandard`` e ``msgpack``
+instalados, o servidor só negocia gzip e JSON.
+"""
+import gzip
+import json
+import os
+import zlib
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+logger = logging.getLogger(__name__)
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Limite do corpo descomprimido, para evitar "bombas" de compressão
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", 64 * 1024 * 1024))
+
+
+class PayloadTooLarge(Exception):
+    pass
+
+
+class UnsupportedEncoding(Exception):
+    pass
+
+
+def accepted_encodings(accept_encoding):
+    """Codificações aceitas pelo cliente, ignorando as marcadas com q=0"""
+    encodings = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            encodings.add(name.strip())
+    return encodings
+
+
+def request_encodings():
+    """Compressões aceitas nos corpos de requisição, em ordem de preferência"""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def choose_encoding(accept_encoding):
+    encodings = accepted_encodings(accept_encoding)
+    if zstandard is not None and "zstd" in encodings:
+        return "zstd"
+    if "gzip" in encodings:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+def decompress(body, encoding, max_size=MAX_DECOMPRESSED_BODY):
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(wbits=31)
+        data = decompressor.decompress(body, max_size + 1)
+    elif encoding == "zstd" and zstandard is not None:
+        with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+            data = reader.read(max_size + 1)
+    else:
+        raise UnsupportedEncoding(encoding)
+    if len(data) > max_size:
+        raise PayloadTooLarge()
+    return data
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size=1024, msgpack_paths=("/commands/",)):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.msgpack_paths = tuple(msgpack_paths)
+        self.advertised = ", ".join(request_encodings()).encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope["headers"]}
+        content_encoding = headers.get("content-encoding", "").strip().lower()
+        msgpack_path = msgpack is not None and scope["path"].startswith(self.msgpack_paths)
+        # Toda resposta daqui pode variar com o Accept-Encoding (e, nos endpoints
+        # de comandos, com o Accept), mesmo quando sai sem compressão
+        negotiation = [
+            (b"vary", b"Accept-Encoding, Accept" if msgpack_path else b"Accept-Encoding"),
+            (b"accept-encoding", self.advertised),
+        ]
+        msgpack_request = msgpack_path and headers.get("content-type", "").startswith(MSGPACK_MEDIA_TYPE)
+
+        if content_encoding not in ("", "identity") or msgpack_request:
+            body = await self._read_body(receive)
+            try:
+                if content_encoding not in ("", "identity"):
+                    body = decompress(body, content_encoding)
+                if msgpack_request:
+                    body = json.dumps(msgpack.unpackb(body, raw=False)).encode("utf-8")
+            except PayloadTooLarge:
+                await self._error(send, 413, "Corpo descomprimido muito grande", negotiation)
+                return
+            except UnsupportedEncoding:
+                await self._error(send, 415, f"Content-Encoding não suportado: {content_encoding}", negotiation)
+                return
+            except Exception as e:
+                logger.warning(f"Corpo de requisição inválido ({content_encoding or MSGPACK_MEDIA_TYPE}): {str(e)}")
+                await self._error(send, 400, "Corpo de requisição inválido", negotiation)
+                return
+
+            scope = dict(scope)
+            new_headers = [
+                (k, v) for k, v in scope["headers"]
+                if k not in (b"content-encoding", b"content-length", b"content-type")
+            ]
+            new_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            new_headers.append((b"content-type", b"application/json" if msgpack_request
+                                else headers.get("content-type", "application/json").encode("latin-1")))
+            scope["headers"] = new_headers
+            receive = self._replay(body, receive)
+
+        encoding = choose_encoding(headers.get("accept-encoding", ""))
+        msgpack_response = msgpack_path and MSGPACK_MEDIA_TYPE in headers.get("accept", "")
+        if encoding is None and not msgpack_response:
+            await self.app(scope, receive, self._header_send(send, negotiation))
+            return
+
+        await self.app(scope, receive, self._buffered_send(send, encoding, msgpack_response, negotiation))
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    @staticmethod
+    def _replay(body, receive):
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay
+
+    @staticmethod
+    async def _error(send, status, detail, extra_headers):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("latin-1"))] + extra_headers,
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    def _header_send(send, extra_headers):
+        async def with_headers(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + extra_headers)
+            await send(message)
+
+        return with_headers
+
+    def _buffered_send(self, send, encoding, msgpack_response, extra_headers):
+        # As respostas da API são JSON pequenos e não-streaming: o corpo é
+        # acumulado e convertido/comprimido de uma vez
+        start = None
+        chunks = []
+
+        async def buffered(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            headers = [(k, v) for k, v in start.get("headers", []) if k != b"content-length"]
+            header_names = {k.lower() for k, _ in headers}
+
+            content_type = dict(headers).get(b"content-type", b"")
+            if msgpack_response and content_type.startswith(b"application/json"):
+                body = msgpack.packb(json.loads(body), use_bin_type=True)
+                headers = [(k, v) for k, v in headers if k != b"content-type"]
+                headers.append((b"content-type", MSGPACK_MEDIA_TYPE.encode("latin-1")))
+
+            if encoding and len(body) >= self.minimum_size and b"content-encoding" not in header_names:
+                body = compress(body, encoding)
+                headers.append((b"content-encoding", encoding.encode("latin-1")))
+
+            headers.append((b"content-length", str(len(body)).encode("latin-1")))
+            headers.extend(extra_headers)
+            await send(dict(start, headers=headers))
+            await send({"type": "http.response.body", "body": body})
+
+        return buffered
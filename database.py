@@ -0,0 +1,176 @@
+from dotenv import load_dotenv
+from datetime import datetime
+from contextlib import contextmanager
+import asyncio
+import os
+import select
+import threading
+import time
+from sqlalchemy import create_engine, text, Column, String, Integer, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+import uuid
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Configuração do banco
+load_dotenv()
+DATABASE = os.getenv("DATABASE_URL")
+if not DATABASE:
+    raise ValueError("DATABASE_URL não está definida nas variáveis de ambiente")
+
+DATABASE = DATABASE.replace("postgres://", "postgresql://")
+# Cada worker do uvicorn tem o seu próprio pool; o total de conexões é
+# workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) + 1 conexão de LISTEN por worker
+engine = create_engine(
+    DATABASE,
+    pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 5)),
+    pool_pre_ping=True
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+Base = declarative_base()
+
+
+# Modelos do banco
+class Machine(Base):
+    __tablename__ = "machines"
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    name = Column(String, nullable=False)
+    last_seen = Column(DateTime, default=datetime.utcnow)
+
+
+class Script(Base):
+    __tablename__ = "scripts"
+    name = Column(String, primary_key=True)
+    content = Column(Text, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+    # Veredito de segurança calculado no registro (e revalidado quando as regras mudam)
+    content_hash = Column(String(64))
+    is_dangerous = Column(Boolean, nullable=False, default=False)
+    matched_rule = Column(Text)
+    ruleset_version = Column(String(16))
+    validated_at = Column(DateTime)
+
+
+class Command(Base):
+    __tablename__ = "commands"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    machine_id = Column(String, ForeignKey("machines.id"))
+    script_name = Column(String, ForeignKey("scripts.name"))
+    status = Column(String, default="pending")  # pending, completed, cancelled
+    output = Column(Text, default="")
+    return_code = Column(Integer)
+
+
+class Workflow(Base):
+    __tablename__ = "workflows"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    status = Column(String, default="running")  # running, completed, failed
+    max_concurrency = Column(Integer, nullable=False, default=1)  # máquinas executando ao mesmo tempo
+    max_failures = Column(Integer, nullable=False, default=0)  # falhas toleradas antes de parar
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class WorkflowStep(Base):
+    __tablename__ = "workflow_steps"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    workflow_id = Column(Integer, ForeignKey("workflows.id"), nullable=False)
+    step_key = Column(String, nullable=False)
+    script_name = Column(String, ForeignKey("scripts.name"), nullable=False)
+    machine_id = Column(String, ForeignKey("machines.id"), nullable=False)
+    depends_on = Column(Text, default="")  # chaves das etapas separadas por vírgula
+    status = Column(String, default="waiting")  # waiting, dispatched, completed, failed, cancelled
+    command_id = Column(Integer, ForeignKey("commands.id"))
+
+
+# Coordenação entre workers via PostgreSQL
+NEW_COMMAND_CHANNEL = "new_command"
+
+# Chaves de advisory locks usadas pelos workers
+REVALIDATION_LOCK_ID = 2026001
+
+
+def notify_new_command(db, machine_id):
+    """Avisa todos os workers que há comando novo para a máquina (entregue no commit)"""
+    db.execute(text("SELECT pg_notify(:channel, :machine_id)"),
+               {"channel": NEW_COMMAND_CHANNEL, "machine_id": machine_id})
+
+
+class CommandWakeups:
+    """Acorda os long-polls deste processo quando qualquer worker agenda um comando.
+
+    Cada processo mantém uma única conexão em LISTEN; as requisições em
+    espera são corrotinas no event loop e não seguram threads nem
+    conexões do pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = {}  # machine_id -> {(loop, asyncio.Event)}
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._listen, name="command-wakeups", daemon=True)
+            self._thread.start()
+
+    @contextmanager
+    def subscribe(self, machine_id):
+        """Registra uma espera por comandos da máquina; deve ser usado dentro do event loop.
+
+        A inscrição é feita antes de consultar o banco, para não perder um
+        comando agendado entre a consulta e a espera.
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(machine_id, set()).add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(machine_id)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[machine_id]
+
+    def _wake(self, machine_id=None):
+        with self._lock:
+            if machine_id is None:
+                waiters = [w for machine_waiters in self._waiters.values() for w in machine_waiters]
+            else:
+                waiters = list(self._waiters.get(machine_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _listen(self):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(DATABASE)
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NEW_COMMAND_CHANNEL}")
+                logger.info(f"Escutando notificações em {NEW_COMMAND_CHANNEL}")
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._wake(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Conexão de LISTEN perdida: {str(e)}")
+                # Notificações podem ter sido perdidas: quem espera volta a consultar o banco
+                self._wake()
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
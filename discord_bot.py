@@ -7,8 +7,6 @@ import logging
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
-from security import CommandSecurity
-
 
 # Configuração de LOGGING
 logging.basicConfig(
@@ -149,14 +147,15 @@ async def on_message(message):
             return
 
         name, content = parts[1], parts[2]
-        if CommandSecurity.is_dangerous(content):
-            logger.warning(
-                f"Tentativa de registrar script perigoso por {message.author}: {content}")
-            await message.channel.send(f"❌ Script '{name}' contém comandos perigosos e não pode ser registrado!")
-            return
 
         try:
-            await make_post_request("scripts", {"name": name, "content": content})
+            # A validação de segurança é feita uma única vez, pelo servidor
+            data = await make_post_request("scripts", {"name": name, "content": content})
+            if "detail" in data:
+                logger.warning(
+                    f"Script recusado pelo servidor, enviado por {message.author}: {content} ({data['detail']})")
+                await message.channel.send(f"❌ Script '{name}' não pode ser registrado: {data['detail']}")
+                return
             await message.channel.send(f"✅ Script '{name}' registrado com sucesso!")
         except Exception as e:
             logger.error(f"Erro ao registrar script '{name}': {e}")
@@ -0,0 +1,44 @@
+"""Cria e atualiza o schema do banco.
+
+Roda uma única vez por deploy (fase release do Procfile), antes de subir
+os workers da API, para que nenhum worker altere o schema em paralelo.
+"""
+import logging
+from sqlalchemy import text
+from database import engine, Base
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger("migrate")
+
+
+def migrate():
+    logger.info("Criando tabelas ausentes")
+    Base.metadata.create_all(bind=engine)
+
+    # Colunas adicionadas depois da criação inicial das tabelas
+    with engine.begin() as conn:
+        conn.execute(text("""
+            ALTER TABLE scripts
+                ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1,
+                ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS is_dangerous BOOLEAN NOT NULL DEFAULT FALSE,
+                ADD COLUMN IF NOT EXISTS matched_rule TEXT,
+                ADD COLUMN IF NOT EXISTS ruleset_version VARCHAR(16),
+                ADD COLUMN IF NOT EXISTS validated_at TIMESTAMP
+        """))
+        conn.execute(text("ALTER TABLE commands ADD COLUMN IF NOT EXISTS return_code INTEGER"))
+
+        # Índices usados pelos caminhos mais quentes (poll dos agentes e heartbeat)
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_commands_machine_status ON commands (machine_id, status)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_machines_name ON machines (name)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_workflow_steps_workflow ON workflow_steps (workflow_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_workflow_steps_command ON workflow_steps (command_id)"))
+    logger.info("Schema atualizado")
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,5 +1,6 @@
+import hashlib
 import re
-from typing import List
+from typing import List, Optional
 
 
 class CommandSecurity:
@@ -63,9 +64,31 @@ class CommandSecurity:
         'iptables -P INPUT ACCEPT', 'ufw disable', 'mkfs'
     ]
 
+    # Versão do conjunto de regras: muda sempre que um padrão ou comando é alterado
+    RULESET_VERSION = hashlib.sha256(
+        "\n".join(DANGEROUS_COMMANDS + DANGEROUS_PATTERNS).encode("utf-8")
+    ).hexdigest()[:16]
+
+    # Padrões compilados uma única vez, no primeiro uso (o agente raramente precisa deles)
+    _COMPILED_PATTERNS = None
+
     @classmethod
-    def is_dangerous(cls, command: str) -> bool:
-        """Verifica se um comando é perigoso com maior precisão"""
+    def _compiled_patterns(cls):
+        if cls._COMPILED_PATTERNS is None:
+            cls._COMPILED_PATTERNS = [
+                (pattern, re.compile(pattern, re.IGNORECASE | re.MULTILINE))
+                for pattern in cls.DANGEROUS_PATTERNS
+            ]
+        return cls._COMPILED_PATTERNS
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        """Hash SHA-256 do conteúdo de um script"""
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def matched_rule(cls, command: str) -> Optional[str]:
+        """Retorna a regra que classificou o comando como perigoso, ou None"""
         # Normaliza o comando: remove espaços extras, tabulações e converte para minúsculas
         normalized_cmd = ' '.join(command.split()).lower()
 
@@ -75,11 +98,27 @@ class CommandSecurity:
         # Verifica comandos perigosos completos
         for dangerous_cmd in cls.DANGEROUS_COMMANDS:
             if dangerous_cmd in normalized_cmd:
-                return True
+                return dangerous_cmd
 
         # Verifica padrões perigosos com regex
-        for pattern in cls.DANGEROUS_PATTERNS:
-            if re.search(pattern, normalized_cmd, re.IGNORECASE | re.MULTILINE):
-                return True
+        for pattern, compiled in cls._compiled_patterns():
+            if compiled.search(normalized_cmd):
+                return pattern
 
-        return False
\ No newline at end of file
+        return None
+
+    @classmethod
+    def is_dangerous(cls, command: str) -> bool:
+        """Verifica se um comando é perigoso com maior precisão"""
+        return cls.matched_rule(command) is not None
+
+    @classmethod
+    def verdict(cls, content: str) -> dict:
+        """Veredito completo de um script, para ser armazenado junto com ele"""
+        rule = cls.matched_rule(content)
+        return {
+            "content_hash": cls.content_hash(content),
+            "is_dangerous": rule is not None,
+            "matched_rule": rule,
+            "ruleset_version": cls.RULESET_VERSION,
+        }
@@ -1,14 +1,20 @@
-from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from datetime import datetime, timedelta
+from collections import defaultdict
+from typing import List, Optional
 import os
-from sqlalchemy import create_engine, Column, String, Integer, Text, DateTime, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-import uuid
+import asyncio
+from sqlalchemy import text
 import logging
+import threading
 from security import CommandSecurity
+from compression import CompressionMiddleware
+from database import (
+    SessionLocal, Machine, Script, Command, Workflow, WorkflowStep,
+    notify_new_command, CommandWakeups, REVALIDATION_LOCK_ID
+)
 
 
 logging.basicConfig(
@@ -17,43 +23,71 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Configuração do banco
-load_dotenv()
-DATABASE = os.getenv("DATABASE_URL")
-if not DATABASE:
-    raise ValueError("DATABASE_URL não está definida nas variáveis de ambiente")
+# Heartbeats mais próximos que isso não geram escrita no banco
+HEARTBEAT_COALESCE_SECONDS = int(os.getenv("HEARTBEAT_COALESCE_SECONDS", 30))
+# Tempo máximo que um long-poll de comandos pode ficar esperando; fica abaixo
+# dos 30 s em que o roteador do Heroku corta requisições sem resposta (H12)
+MAX_LONG_POLL_SECONDS = int(os.getenv("MAX_LONG_POLL_SECONDS", 25))
 
-DATABASE = DATABASE.replace("postgres://", "postgresql://")
-engine = create_engine(DATABASE)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+wakeups = CommandWakeups()
 
 
-# Modelos do banco
-class Machine(Base):
-    __tablename__ = "machines"
-    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
-    name = Column(String, nullable=False)
-    last_seen = Column(DateTime, default=datetime.utcnow)
+def apply_verdict(script, verdict=None):
+    """Grava no script o veredito de segurança do seu conteúdo atual.
 
+    Se o veredito já foi calculado para esse conteúdo, é reaproveitado.
+    """
+    if verdict is None:
+        verdict = CommandSecurity.verdict(script.content)
+    script.content_hash = verdict["content_hash"]
+    script.is_dangerous = verdict["is_dangerous"]
+    script.matched_rule = verdict["matched_rule"]
+    script.ruleset_version = verdict["ruleset_version"]
+    script.validated_at = datetime.utcnow()
+    return verdict
 
-class Script(Base):
-    __tablename__ = "scripts"
-    name = Column(String, primary_key=True)
-    content = Column(Text, nullable=False)
 
+def revalidate_scripts():
+    """Revalida os scripts cujo veredito foi calculado com outro conjunto de regras"""
+    db = SessionLocal()
+    try:
+        # Só um worker revalida; os demais seguem sem esperar
+        if not db.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": REVALIDATION_LOCK_ID}).scalar():
+            logger.info("Revalidação de scripts já em andamento em outro worker")
+            return
 
-class Command(Base):
-    __tablename__ = "commands"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    machine_id = Column(String, ForeignKey("machines.id"))
-    script_name = Column(String, ForeignKey("scripts.name"))
-    status = Column(String, default="pending")  # pending, completed
-    output = Column(Text, default="")
+        stale_scripts = db.query(Script).filter(
+            (Script.ruleset_version.is_(None)) | (Script.ruleset_version != CommandSecurity.RULESET_VERSION)
+        ).all()
+        if not stale_scripts:
+            return
+
+        logger.info(f"Revalidando {len(stale_scripts)} script(s) com as regras {CommandSecurity.RULESET_VERSION}")
+        for script in stale_scripts:
+            was_dangerous = script.is_dangerous
+            apply_verdict(script)
+            if script.is_dangerous and not was_dangerous:
+                logger.warning(f"Script {script.name} passou a ser considerado perigoso: {script.matched_rule}")
+        db.commit()
+        logger.info("Revalidação de scripts concluída")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Erro ao revalidar scripts: {str(e)}")
+    finally:
+        db.close()
 
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI()
+# Negocia gzip/zstd nos dois sentidos e msgpack nos endpoints de comandos
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", 1024)))
+
+
+@app.on_event("startup")
+def start_background_tasks():
+    wakeups.start()
+    # Executa em segundo plano para não atrasar a subida da API
+    threading.Thread(target=revalidate_scripts, name="revalidate-scripts", daemon=True).start()
+
 
 # Modelos Pydantic
 class MachineRegistration(BaseModel):
@@ -72,6 +106,7 @@ class ExecuteRequest(BaseModel):
 
 class CommandResult(BaseModel):
     output: str
+    return_code: Optional[int] = None
 
 
 class CommandResultInput(BaseModel):
@@ -80,6 +115,144 @@ class CommandResultInput(BaseModel):
     output: str
 
 
+class WorkflowStepInput(BaseModel):
+    key: str
+    script_name: str
+    machines: List[str]
+    depends_on: List[str] = []
+
+
+class WorkflowRequest(BaseModel):
+    name: str
+    steps: List[WorkflowStepInput]
+    max_concurrency: int = 1
+    max_failures: int = 0
+
+
+# Scheduler de workflows
+TERMINAL_STEP_STATUSES = ("completed", "failed", "cancelled")
+
+
+def validate_workflow_graph(steps):
+    """Garante que as dependências existem e que o grafo não tem ciclos"""
+    if not steps:
+        raise HTTPException(status_code=400, detail="Workflow sem etapas")
+
+    keys = [step.key for step in steps]
+    if len(keys) != len(set(keys)):
+        raise HTTPException(status_code=400, detail="Chaves de etapas duplicadas")
+    # depends_on é gravado com as chaves separadas por vírgula
+    invalid_keys = [key for key in keys if not key or "," in key]
+    if invalid_keys:
+        raise HTTPException(status_code=400, detail=f"Chaves de etapas inválidas (vazias ou com vírgula): {invalid_keys}")
+
+    for step in steps:
+        if not step.machines:
+            raise HTTPException(status_code=400, detail=f"Etapa {step.key} sem máquinas")
+        if len(step.machines) != len(set(step.machines)):
+            raise HTTPException(status_code=400, detail=f"Máquinas duplicadas na etapa {step.key}")
+        for dep in step.depends_on:
+            if dep not in keys:
+                raise HTTPException(status_code=400, detail=f"Etapa {step.key} depende de etapa inexistente: {dep}")
+
+    # Ordenação topológica (Kahn) para detectar ciclos
+    pending_deps = {step.key: set(step.depends_on) for step in steps}
+    resolved = set()
+    while pending_deps:
+        ready = [key for key, deps in pending_deps.items() if deps <= resolved]
+        if not ready:
+            raise HTTPException(status_code=400, detail=f"Ciclo de dependências entre: {', '.join(sorted(pending_deps))}")
+        for key in ready:
+            resolved.add(key)
+            del pending_deps[key]
+
+
+def step_dependencies(run, runs_by_key):
+    """Execuções das quais uma execução depende.
+
+    Se a etapa de origem também roda na mesma máquina, a dependência é só
+    com aquela máquina (ex.: drenar -> atualizar por máquina); caso
+    contrário, depende de todas as execuções da etapa de origem.
+    """
+    deps = []
+    for dep_key in filter(None, run.depends_on.split(",")):
+        dep_runs = runs_by_key[dep_key]
+        same_machine = [d for d in dep_runs if d.machine_id == run.machine_id]
+        deps.extend(same_machine or dep_runs)
+    return deps
+
+
+def advance_workflow(db, workflow_id):
+    """Despacha as etapas prontas de um workflow e atualiza seu status.
+
+    Deve ser chamado dentro de uma transação; a linha do workflow é
+    bloqueada para que resultados simultâneos não despachem em dobro.
+    """
+    workflow = db.query(Workflow).filter(Workflow.id == workflow_id).with_for_update().first()
+    if not workflow or workflow.status != "running":
+        return
+
+    runs = db.query(WorkflowStep).filter(WorkflowStep.workflow_id == workflow.id).order_by(WorkflowStep.id).all()
+    runs_by_key = defaultdict(list)
+    for run in runs:
+        runs_by_key[run.step_key].append(run)
+
+    failures = sum(1 for run in runs if run.status == "failed")
+    if failures > workflow.max_failures:
+        dispatched_commands = [run.command_id for run in runs if run.status == "dispatched"]
+        for run in runs:
+            if run.status in ("waiting", "dispatched"):
+                run.status = "cancelled"
+        # Comandos já despachados mas ainda não buscados pelos agentes não devem mais rodar
+        if dispatched_commands:
+            db.query(Command).filter(
+                Command.id.in_(dispatched_commands),
+                Command.status == "pending"
+            ).update({Command.status: "cancelled"}, synchronize_session=False)
+        workflow.status = "failed"
+        logger.warning(f"Workflow {workflow.id} interrompido: {failures} falha(s), limite {workflow.max_failures}")
+        return
+
+    # Cancela em cascata as execuções cujas dependências falharam
+    changed = True
+    while changed:
+        changed = False
+        for run in runs:
+            if run.status == "waiting" and any(
+                d.status in ("failed", "cancelled") for d in step_dependencies(run, runs_by_key)
+            ):
+                run.status = "cancelled"
+                changed = True
+
+    busy_machines = {run.machine_id for run in runs if run.status == "dispatched"}
+    started_machines = {run.machine_id for run in runs if run.status != "waiting"}
+    ready = [
+        run for run in runs
+        if run.status == "waiting"
+        and all(d.status == "completed" for d in step_dependencies(run, runs_by_key))
+    ]
+    # Máquinas que já começaram têm prioridade, para o rollout andar máquina a máquina
+    ready.sort(key=lambda run: run.machine_id not in started_machines)
+
+    for run in ready:
+        if run.machine_id in busy_machines:
+            continue
+        if len(busy_machines) >= workflow.max_concurrency:
+            break
+        command = Command(machine_id=run.machine_id, script_name=run.script_name, status="pending")
+        db.add(command)
+        db.flush()
+        run.command_id = command.id
+        run.status = "dispatched"
+        notify_new_command(db, run.machine_id)
+        busy_machines.add(run.machine_id)
+        logger.info(f"Workflow {workflow.id}: etapa {run.step_key} despachada para máquina {run.machine_id} (comando {command.id})")
+
+    if all(run.status in TERMINAL_STEP_STATUSES for run in runs):
+        workflow.status = "completed"
+        logger.info(f"Workflow {workflow.id} concluído com {failures} falha(s)")
+
+
 # Endpoints
 @app.get("/")
 def root():
@@ -106,12 +279,23 @@ def register_machine(machine: MachineRegistration):
     db = SessionLocal()
     try:
         existing_machine = db.query(Machine).filter(Machine.name == machine.name).first()
+        now = datetime.utcnow()
+
+        # Heartbeat recente: nada a gravar, sem lock nem escrita
+        if (existing_machine and existing_machine.last_seen
+                and now - existing_machine.last_seen < timedelta(seconds=HEARTBEAT_COALESCE_SECONDS)):
+            return {"message": "Máquina atualizada", "machine_id": existing_machine.id}
+
+        # Serializa registros simultâneos do mesmo nome entre workers, evitando duplicatas
+        db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": machine.name})
+        existing_machine = db.query(Machine).filter(Machine.name == machine.name).populate_existing().first()
 
         if existing_machine:
-            existing_machine.last_seen = datetime.utcnow()
+            machine_id = existing_machine.id
+            existing_machine.last_seen = now
             db.commit()
-            logger.info(f"Máquina atualizada: {existing_machine.id} - {existing_machine.name}")
-            return {"message": "Máquina atualizada", "machine_id": existing_machine.id}
+            logger.info(f"Máquina atualizada: {machine_id} - {machine.name}")
+            return {"message": "Máquina atualizada", "machine_id": machine_id}
         else:
             new_machine = Machine(name=machine.name, last_seen=datetime.utcnow())
             db.add(new_machine)
@@ -129,25 +313,33 @@ def register_machine(machine: MachineRegistration):
 @app.post("/scripts")
 def register_script(script: ScriptRegistration):
     logger.info(f"Registrando script: {script.name}")
-    if CommandSecurity.is_dangerous(script.content):
-        logger.warning(f"Script perigoso bloqueado: {script.name}")
-        raise HTTPException(status_code=400, detail="Script perigoso detectado")
+    verdict = CommandSecurity.verdict(script.content)
+    if verdict["is_dangerous"]:
+        logger.warning(f"Script perigoso bloqueado: {script.name} (regra: {verdict['matched_rule']})")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Script perigoso detectado (regra: {verdict['matched_rule']})"
+        )
 
     db = SessionLocal()
     try:
         existing_script = db.query(Script).filter(Script.name == script.name).first()
 
         if existing_script:
+            if existing_script.content_hash != verdict["content_hash"]:
+                existing_script.version = (existing_script.version or 1) + 1
             existing_script.content = script.content
+            apply_verdict(existing_script, verdict)
             db.commit()
-            logger.info(f"Script atualizado: {script.name}")
-            return {"message": "Script atualizado com sucesso."}
+            logger.info(f"Script atualizado: {script.name} (versão {existing_script.version})")
+            return {"message": "Script atualizado com sucesso.", "version": existing_script.version}
         else:
-            new_script = Script(name=script.name, content=script.content)
+            new_script = Script(name=script.name, content=script.content, version=1)
+            apply_verdict(new_script, verdict)
             db.add(new_script)
             db.commit()
             logger.info(f"Novo script registrado: {script.name}")
-            return {"message": "Script registrado com sucesso."}
+            return {"message": "Script registrado com sucesso.", "version": 1}
     except Exception as e:
         db.rollback()
         logger.error(f"Erro ao registrar script {script.name}: {str(e)}")
@@ -171,8 +363,16 @@ def execute_script(request: ExecuteRequest):
             logger.warning(f"Script não encontrado: {request.script_name}")
             raise HTTPException(status_code=404, detail="Script não encontrado")
 
+        if script.is_dangerous:
+            logger.warning(f"Execução recusada, script perigoso: {request.script_name} (regra: {script.matched_rule})")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Script perigoso detectado (regra: {script.matched_rule})"
+            )
+
         new_command = Command(machine_id=machine.id, script_name=request.script_name, status="pending")
         db.add(new_command)
+        notify_new_command(db, machine.id)
         db.commit()
         db.refresh(new_command)
 
@@ -186,22 +386,53 @@ def execute_script(request: ExecuteRequest):
 
 
 @app.get("/commands/{machine_id}")
-def get_pending_commands(machine_id: str):
+async def get_pending_commands(machine_id: str, wait: int = 0):
     logger.info(f"Buscando comandos pendentes para máquina {machine_id}")
+    wait = min(max(wait, 0), MAX_LONG_POLL_SECONDS)
+
+    if not wait:
+        commands = await run_in_threadpool(fetch_pending_commands, machine_id)
+    else:
+        # Long-poll: espera no event loop, sem segurar thread nem conexão do banco
+        with wakeups.subscribe(machine_id) as woken:
+            commands = await run_in_threadpool(fetch_pending_commands, machine_id)
+            if not commands:
+                try:
+                    await asyncio.wait_for(woken.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    commands = await run_in_threadpool(fetch_pending_commands, machine_id)
+
+    logger.info(f"{len(commands)} comandos pendentes encontrados para máquina {machine_id}")
+    return {"commands": commands}
+
+
+def fetch_pending_commands(machine_id):
     db = SessionLocal()
     try:
         commands = db.query(Command).filter(
             Command.machine_id == machine_id,
             Command.status == "pending"
         ).all()
-        logger.info(f"{len(commands)} comandos pendentes encontrados para máquina {machine_id}")
-        return {"commands": [
+        script_names = {cmd.script_name for cmd in commands}
+        scripts = {
+            s.name: s for s in db.query(Script).filter(Script.name.in_(script_names)).all()
+        } if script_names else {}
+        return [
             {
                 "id": cmd.id,
                 "script_name": cmd.script_name,
-                "script_content": db.query(Script).filter(Script.name == cmd.script_name).first().content
+                "script_content": scripts[cmd.script_name].content,
+                "script_version": scripts[cmd.script_name].version,
+                "verdict": {
+                    "content_hash": scripts[cmd.script_name].content_hash,
+                    "is_dangerous": scripts[cmd.script_name].is_dangerous,
+                    "matched_rule": scripts[cmd.script_name].matched_rule,
+                    "ruleset_version": scripts[cmd.script_name].ruleset_version,
+                }
             } for cmd in commands
-        ]}
+        ]
     finally:
         db.close()
 
@@ -211,18 +442,38 @@ def post_command_result(command_id: int, result: CommandResult):
     logger.info(f"Recebido resultado para comando {command_id}")
     db = SessionLocal()
     try:
-        command = db.query(Command).filter(Command.id == command_id).first()
+        # Etapa de workflow: a linha do workflow é bloqueada antes de alterar o
+        # comando e a etapa, na mesma ordem de advance_workflow, evitando deadlock
+        step = db.query(WorkflowStep).filter(WorkflowStep.command_id == command_id).first()
+        if step:
+            db.query(Workflow).filter(Workflow.id == step.workflow_id).with_for_update().first()
+            db.refresh(step)
+
+        command = db.query(Command).filter(Command.id == command_id).populate_existing().first()
         if not command:
             logger.warning(f"Comando {command_id} não encontrado")
             raise HTTPException(status_code=404, detail="Comando não encontrado")
 
-        command.status = "completed"
         command.output = result.output
+        command.return_code = result.return_code
+        if command.status == "cancelled":
+            # Resultado tardio de um comando cancelado: guarda a saída, mas o
+            # comando e a etapa continuam cancelados
+            db.commit()
+            logger.warning(f"Resultado recebido para comando cancelado {command_id}")
+            return {"message": "Resultado registrado (comando cancelado)"}
+        command.status = "completed"
+
+        if step and step.status == "dispatched":
+            step.status = "failed" if result.return_code not in (None, 0) else "completed"
+            db.flush()
+            advance_workflow(db, step.workflow_id)
         db.commit()
 
         logger.info(f"Resultado registrado para comando {command_id}")
         return {"message": "Resultado registrado"}
     except Exception as e:
+        db.rollback()
         logger.error(f"Erro ao registrar resultado do comando {command_id}: {str(e)}")
         raise
     finally:
@@ -254,7 +505,103 @@ def get_last_command_result(machine_id: str):
             "command_id": command.id,
             "script_name": command.script_name,
             "output": command.output,
-            "status": command.status
+            "status": command.status,
+            "return_code": command.return_code
+        }
+    finally:
+        db.close()
+
+
+@app.post("/workflows")
+def create_workflow(request: WorkflowRequest):
+    logger.info(f"Criando workflow: {request.name} ({len(request.steps)} etapa(s))")
+    if request.max_concurrency < 1 or request.max_failures < 0:
+        raise HTTPException(status_code=400, detail="max_concurrency deve ser >= 1 e max_failures >= 0")
+    validate_workflow_graph(request.steps)
+
+    db = SessionLocal()
+    try:
+        machine_names = {name for step in request.steps for name in step.machines}
+        machines = {m.name: m for m in db.query(Machine).filter(Machine.name.in_(machine_names)).all()}
+        missing_machines = machine_names - machines.keys()
+        if missing_machines:
+            logger.warning(f"Máquinas não encontradas: {', '.join(sorted(missing_machines))}")
+            raise HTTPException(status_code=404, detail=f"Máquinas não encontradas: {', '.join(sorted(missing_machines))}")
+
+        script_names = {step.script_name for step in request.steps}
+        scripts = {s.name: s for s in db.query(Script).filter(Script.name.in_(script_names)).all()}
+        missing_scripts = script_names - scripts.keys()
+        if missing_scripts:
+            logger.warning(f"Scripts não encontrados: {', '.join(sorted(missing_scripts))}")
+            raise HTTPException(status_code=404, detail=f"Scripts não encontrados: {', '.join(sorted(missing_scripts))}")
+
+        dangerous = sorted(name for name, s in scripts.items() if s.is_dangerous)
+        if dangerous:
+            logger.warning(f"Workflow recusado, scripts perigosos: {', '.join(dangerous)}")
+            raise HTTPException(status_code=400, detail=f"Scripts perigosos detectados: {', '.join(dangerous)}")
+
+        workflow = Workflow(
+            name=request.name,
+            status="running",
+            max_concurrency=request.max_concurrency,
+            max_failures=request.max_failures
+        )
+        db.add(workflow)
+        db.flush()
+
+        for step in request.steps:
+            for machine_name in step.machines:
+                db.add(WorkflowStep(
+                    workflow_id=workflow.id,
+                    step_key=step.key,
+                    script_name=step.script_name,
+                    machine_id=machines[machine_name].id,
+                    depends_on=",".join(step.depends_on),
+                    status="waiting"
+                ))
+        db.flush()
+
+        advance_workflow(db, workflow.id)
+        db.commit()
+
+        logger.info(f"Workflow agendado: id={workflow.id}, nome={request.name}")
+        return {"message": "Workflow agendado", "workflow_id": workflow.id}
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Erro ao criar workflow {request.name}: {str(e)}")
+        raise
+    finally:
+        db.close()
+
+
+@app.get("/workflows/{workflow_id}")
+def get_workflow(workflow_id: int):
+    logger.info(f"Buscando workflow {workflow_id}")
+    db = SessionLocal()
+    try:
+        workflow = db.query(Workflow).filter(Workflow.id == workflow_id).first()
+        if not workflow:
+            logger.warning(f"Workflow {workflow_id} não encontrado")
+            raise HTTPException(status_code=404, detail="Workflow não encontrado")
+
+        runs = db.query(WorkflowStep).filter(WorkflowStep.workflow_id == workflow.id).order_by(WorkflowStep.id).all()
+        machines = {m.id: m.name for m in db.query(Machine).filter(Machine.id.in_({r.machine_id for r in runs})).all()} if runs else {}
+        return {
+            "workflow_id": workflow.id,
+            "name": workflow.name,
+            "status": workflow.status,
+            "max_concurrency": workflow.max_concurrency,
+            "max_failures": workflow.max_failures,
+            "steps": [
+                {
+                    "key": run.step_key,
+                    "script_name": run.script_name,
+                    "machine_name": machines.get(run.machine_id),
+                    "depends_on": [d for d in run.depends_on.split(",") if d],
+                    "status": run.status,
+                    "command_id": run.command_id
+                } for run in runs
+            ]
         }
     finally:
         db.close()